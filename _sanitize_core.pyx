@@ -0,0 +1,26 @@
+# cython: language_level=3
+"""单遍扫描的代理对转义核心，对应 deepseek.TextSanitizer 的阶段2。
+
+构建（可选）：pip install cython && cythonize -i _sanitize_core.pyx
+未构建时 deepseek.py 自动回退到纯Python实现。
+"""
+
+
+def sanitize_fast(str s):
+    """一次遍历把所有代理对字符替换为 \\uXXXX 转义；干净字符串原样返回"""
+    cdef Py_ssize_t i, start = 0, n = len(s)
+    cdef Py_UCS4 cp
+    cdef list parts = None
+    for i in range(n):
+        cp = s[i]
+        if 0xD800 <= cp < 0xE000:
+            if parts is None:
+                parts = []
+            parts.append(s[start:i])
+            parts.append('\\u%04x' % <unsigned int>cp)
+            start = i + 1
+    if parts is None:
+        # 无代理对：不分配任何新对象
+        return s
+    parts.append(s[start:])
+    return ''.join(parts)
@@ -1,35 +1,95 @@
 import os
 import re
+import sys
+import string
 import json
-import readline
+import unicodedata
+import atexit
+import asyncio
+from collections import deque
 from datetime import datetime
-from openai import OpenAI
-from ftfy import fix_text
+from pathlib import Path
+
+# readline 只对交互式TTY有意义，非TTY场景省掉导入
+if sys.stdin.isatty():
+    import readline
+else:
+    readline = None
+
+# orjson 的C实现序列化更快，没装则回退标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ftfy 较重且大多数文本用不到，首次需要时才导入
+fix_text = None
+
+# 预编译的正则，避免每次调用 sanitize 时重复编译
+_SURROGATE_RE = re.compile(r'[\ud800-\udfff]')
+# mojibake特征：Latin-1误解码UTF-8产生的 Ã./Â./â€ 序列，或替换符
+_MOJIBAKE_RE = re.compile('\\u00c3.|\\u00c2.|\\u00e2\\u20ac|\\ufffd')
+# 文件名白名单：中文、字母、数字、下划线和空格
+_ALLOW = (set(range(0x4e00, 0x9fa6))
+          | set(map(ord, string.ascii_letters + string.digits + '_ ')))
+# ASCII快速路径的删除表：translate 一次C层遍历去掉所有非法ASCII字符
+_KEEP_TABLE = {cp: None for cp in range(128) if cp not in _ALLOW}
+_FILENAME_RE = re.compile(r'[^\u4e00-\u9fa5a-zA-Z0-9_ ]+')
+# 代理对字符 -> \\uXXXX 转义的映射表，str.translate 在C层一次遍历完成替换
+_SURROGATE_TABLE = {cp: f'\\u{cp:04x}' for cp in range(0xD800, 0xE000)}
+
+def _repair_surrogate_pairs(text):
+    """把相邻的高低代理对合并回原字符（如被拆成两个流式增量的emoji）"""
+    if _SURROGATE_RE.search(text) is None:
+        return text
+    # utf-16往返会在C层配对相邻代理对，真正孤立的代理对原样保留
+    return text.encode('utf-16-le', 'surrogatepass').decode('utf-16-le', 'surrogatepass')
+
+
+# 可选的Cython加速版代理对转义（见 _sanitize_core.pyx），未构建时回退纯Python
+try:
+    from _sanitize_core import sanitize_fast as _sanitize_fast
+except ImportError:
+    _sanitize_fast = None
+
 
 class TextSanitizer:
-    def __init__(self):
+    def __init__(self, log_enabled=False):
         self.error_log = []
+        self.log_enabled = log_enabled
+        self._log_fh = None
 
     def sanitize(self, text):
         """多阶段Unicode清理策略"""
+        global fix_text
         if not text:
             return text
 
+        # 快速路径：纯ASCII文本不需要任何清理，直接返回
+        try:
+            text.encode('ascii')
+            return text
+        except UnicodeEncodeError:
+            pass
+
         original = text
+        # 阶段1判定和ftfy导入放在兜底try之外：缺依赖要直接抛ImportError，
+        # 不能被吞成占位文本
+        needs_fix = (_MOJIBAKE_RE.search(text)
+                     or not unicodedata.is_normalized('NFKC', text))
+        if needs_fix and fix_text is None:
+            from ftfy import fix_text
         try:
-            # 阶段1：修复常见Unicode问题
-            text = fix_text(text, normalization='NFKC')
-            
-            # 阶段2：替换代理对字符
-            text = re.sub(
-                r'[\ud800-\udfff]',
-                lambda m: f'\\u{m.group(0).encode("unicode_escape").decode()[-4:]}',
-                text
-            )
-            
-            # 阶段3：严格编码验证
-            text = text.encode('utf-8', 'replace').decode('utf-8')
-            
+            # 阶段1：修复常见Unicode问题（仅在有mojibake特征或未规范化时）
+            if needs_fix:
+                text = fix_text(text, normalization='NFKC')
+
+            # 阶段2：替换代理对字符（优先走Cython扩展的单遍扫描）
+            if _sanitize_fast is not None:
+                text = _sanitize_fast(text)
+            elif _SURROGATE_RE.search(text):
+                text = text.translate(_SURROGATE_TABLE)
+
             if original != text:
                 self._log_error(original, text)
                 
@@ -39,23 +99,33 @@ class TextSanitizer:
             return "[内容包含无法解析的字符]"
 
     def sanitize_message_history(self, messages):
-        """清理整个对话历史"""
-        return [{
+        """清理整个对话历史（已清理过的消息直接复用）"""
+        return [msg if msg.get("_clean") else {
             "role": msg["role"],
-            "content": self.sanitize(msg["content"])
+            "content": self.sanitize(msg["content"]),
+            "_clean": True
         } for msg in messages]
 
     def _log_error(self, original, cleaned):
         """记录字符清理日志"""
+        # 转义交给JSON编码器一遍完成，不再预先过unicode_escape
         error_info = {
             "timestamp": datetime.now().isoformat(),
-            "original": original.encode('unicode_escape').decode(),
-            "cleaned": str(cleaned).encode('unicode_escape').decode()
+            "original": original,
+            "cleaned": str(cleaned)
         }
         self.error_log.append(error_info)
-        with open('char_errors.log', 'a', encoding='utf-8') as f:
-            json.dump(error_info, f, ensure_ascii=False)
-            f.write('\n')
+        if not self.log_enabled:
+            return
+        # 日志句柄只打开一次并带大缓冲，避免每条记录都open/close
+        if self._log_fh is None:
+            self._log_fh = open('char_errors.log', 'a',
+                                encoding='utf-8', buffering=64 * 1024)
+            atexit.register(self._log_fh.close)
+        # 这里必须走标准库json：记录里常含孤立代理对，orjson会直接抛TypeError，
+        # 而 ensure_ascii=True 会在C层把它们转成 \uXXXX
+        line = json.dumps(error_info, ensure_ascii=True)
+        self._log_fh.write(line + '\n')
 
 class DeepSeekChat:
     def __init__(self):
@@ -64,62 +134,149 @@ class DeepSeekChat:
 
         if not self.api_key:
             raise ValueError("set environment DEEPSEEK_API_KEY")
-        
+        if not self.home:
+            # 未设置DEEPSEEK_HOME时退到用户目录，避免在CWD里生成 None/ 目录
+            self.home = os.path.expanduser("~/.deepseek")
+
+        # openai 连带httpx/pydantic导入较慢，用到时再导入
+        from openai import OpenAI, AsyncOpenAI
+
         self.client = OpenAI(
             api_key=self.api_key,
             base_url="https://api.deepseek.com/v1"
         )
-        self.sanitizer = TextSanitizer()
-        self.messages = []
+        # 流式对话用异步客户端，让网络接收和终端渲染重叠
+        self.async_client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url="https://api.deepseek.com/v1"
+        )
+        # 常驻事件循环：httpx的keep-alive连接绑定在循环上，每轮新建会导致
+        # 连接复用时报 Event loop is closed
+        self._loop = asyncio.new_event_loop()
+        atexit.register(self._loop.close)
+        self.sanitizer = TextSanitizer(log_enabled=True)
+        # 保存目录路径只算一次，目录本身推迟到首次保存时创建
+        self._json_dir = Path(self.home) / "json"
+        self._txt_dir = Path(self.home) / "txt"
+        self._dirs_ready = False
         self._initialize_session()
 
     def _initialize_session(self):
         """初始化对话会话"""
-        self.messages = self.sanitizer.sanitize_message_history([{
+        self._system = self.sanitizer.sanitize_message_history([{
             "role": "system",
             "content": "你是一个命令行 AI 助手，回答需要简洁明了，使用中文，并且避免使用 Markdown 格式。请直接回答用户的问题，不要添加额外的说明或格式化内容。"
-        }])
+        }])[0]
+        # 最近10轮对话的滚动窗口，满了自动淘汰最旧消息
+        self._window = deque(maxlen=10)
+        self._cached_title = None
+
+    @property
+    def messages(self):
+        """完整消息列表：系统消息 + 滚动窗口"""
+        return [self._system, *self._window]
 
-    def add_message(self, role, content):
-        """安全添加消息到历史"""
-        clean_content = self.sanitizer.sanitize(content)
-        self.messages.append({
+    @messages.setter
+    def messages(self, msgs):
+        self._system = msgs[0]
+        self._window = deque(msgs[1:], maxlen=10)
+
+    def add_message(self, role, content, clean=False):
+        """安全添加消息到历史；clean=True 表示内容已经清理过"""
+        clean_content = content if clean else self.sanitizer.sanitize(content)
+        self._window.append({
             "role": role,
-            "content": clean_content
+            "content": clean_content,
+            "_clean": True
         })
-        # 保持最近10轮对话
-        if len(self.messages) > 11:  # 1系统消息 + 10轮对话
-            self.messages = [self.messages[0]] + self.messages[-10:]
 
     def stream_chat(self, max_retries=3):
-        """执行带重试机制的流式对话"""
+        """执行带重试机制的流式对话（异步实现的同步入口）"""
+        return self._loop.run_until_complete(self._stream_chat_async(max_retries))
+
+    @staticmethod
+    async def _render_stream(queue):
+        """从队列取流式增量，合并后批量写到stdout"""
+        write = sys.stdout.write
+        flush = sys.stdout.flush
+        while True:
+            item = await queue.get()
+            if item is None:
+                flush()
+                return
+            parts = [item]
+            # 把队列里已到达的增量合并成一次写出
+            while not queue.empty():
+                nxt = queue.get_nowait()
+                if nxt is None:
+                    write("".join(parts))
+                    flush()
+                    return
+                parts.append(nxt)
+            write("".join(parts))
+            flush()
+            # 约16ms的渲染节拍，让后续小增量继续聚批
+            await asyncio.sleep(0.016)
+
+    async def _stream_chat_async(self, max_retries=3):
         attempt = 0
         while attempt < max_retries:
             try:
                 safe_messages = self.sanitizer.sanitize_message_history(self.messages)
-                
-                stream = self.client.chat.completions.create(
+                # 发送前去掉内部的 _clean 标记
+                outgoing = [{"role": m["role"], "content": m["content"]}
+                            for m in safe_messages]
+
+                stream = await self.async_client.chat.completions.create(
                     model="deepseek-chat",
-                    messages=safe_messages,
+                    messages=outgoing,
                     stream=True,
                     temperature=0.7,
                     max_tokens=1024,
                     timeout=30
                 )
-                
-                full_response = []
+
+                # 用bytearray累积UTF-8字节，免去每个增量的str对象开销
+                full_response = bytearray()
+                queue = asyncio.Queue(maxsize=64)
+                # 绑定成局部变量，省掉每个增量的属性查找
+                extend = full_response.extend
+                put = queue.put
                 print("assistant：", end="", flush=True)
-                for chunk in stream:
-                    content = chunk.choices[0].delta.content
-                    if content:
-                        clean_content = self.sanitizer.sanitize(content)
-                        print(clean_content, end="", flush=True)
-                        full_response.append(clean_content)
-                
+                render_task = asyncio.create_task(self._render_stream(queue))
+                try:
+                    # 网络接收和渲染并行：增量进队列，渲染任务负责写终端
+                    async for chunk in stream:
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            # surrogatepass：孤立代理对原样进字节缓冲，流结束后统一处理
+                            extend(content.encode('utf-8', 'surrogatepass'))
+                            if render_task.done():
+                                # 渲染任务已退出，继续put只会堵死在满队列上
+                                break
+                            # 终端写入不能带孤立代理对，渲染前先转成转义
+                            if _SURROGATE_RE.search(content):
+                                content = content.translate(_SURROGATE_TABLE)
+                            await put(content)
+                    await queue.put(None)
+                    await render_task
+                finally:
+                    # 任何异常路径都要收掉渲染任务，不能让它带着残留增量活到下一轮
+                    if not render_task.done():
+                        render_task.cancel()
+                        try:
+                            await render_task
+                        except asyncio.CancelledError:
+                            pass
+
                 print()  # 确保换行
-                self.add_message("assistant", "".join(full_response))
+                # 整段回复只清理一次，避免对每个流式增量重复sanitize
+                # 先把跨增量拆开又重新相邻的代理对合并，再做整段清理
+                clean_text = self.sanitizer.sanitize(_repair_surrogate_pairs(
+                    full_response.decode('utf-8', 'surrogatepass')))
+                self.add_message("assistant", clean_text, clean=True)
                 return
-                
+
             except UnicodeEncodeError as e:
                 attempt += 1
                 print(f"\n编码错误，正在重试({attempt}/{max_retries})...")
@@ -128,7 +285,7 @@ class DeepSeekChat:
                 error_msg = self.sanitizer.sanitize(f"\n请求出错：{str(e)}")
                 print(error_msg)
                 return
-        
+
         print("\n超过最大重试次数，建议开启新对话")
 
     def should_save_conversation(self):
@@ -146,46 +303,57 @@ class DeepSeekChat:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         base_name = f"{self._generate_title()}_{timestamp}"
 
-        # 定义目录路径
-        directory = f"{self.home}/json"
-        # 检测目录是否存在
-        if not os.path.exists(directory):
-            # 如果不存在则创建
-            os.makedirs(directory)
-        
-        directory = f"{self.home}/txt"
-        # 检测目录是否存在
-        if not os.path.exists(directory):
-            # 如果不存在则创建
-            os.makedirs(directory)
-        
-        
+        # 首次保存时创建目录，之后不再做存在性检查
+        if not self._dirs_ready:
+            self._json_dir.mkdir(parents=True, exist_ok=True)
+            self._txt_dir.mkdir(parents=True, exist_ok=True)
+            self._dirs_ready = True
+
         # 保存JSON
-        json_path = f"{self.home}/json/{base_name}.json"
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump({
-                "meta": {
-                    "created_at": datetime.now().isoformat(),
-                    "model": "deepseek-chat",
-                    "message_count": len(self.messages) - 1  # 排除系统消息
-                },
-                "messages": self.messages[1:]  # 排除系统消息
-            }, f, ensure_ascii=False, indent=2)
-
-        # 保存TXT
-        txt_path = f"{self.home}/txt/{base_name}.txt"
-        with open(txt_path, 'w', encoding='utf-8') as f:
-            f.write(f"DeepSeek 对话记录 ({timestamp})\n")
-            f.write("="*50 + "\n")
-            for idx, msg in enumerate(self.messages[1:]):
-                role = "用户" if msg['role'] == 'user' else "助手"
-                f.write(f"[{idx//2+1}] {role}：{msg['content']}\n")
+        json_path = self._json_dir / f"{base_name}.json"
+        payload = {
+            "meta": {
+                "created_at": datetime.now().isoformat(),
+                "model": "deepseek-chat",
+                "message_count": len(self.messages) - 1  # 排除系统消息
+            },
+            # 排除系统消息，并去掉内部的 _clean 标记
+            "messages": [{"role": m["role"], "content": m["content"]}
+                         for m in self.messages[1:]]
+        }
+        if orjson is not None:
+            with open(json_path, 'wb') as f:
+                f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+        else:
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, indent=2)
+
+        # 保存TXT：先拼好全部内容，一次write写出
+        txt_path = self._txt_dir / f"{base_name}.txt"
+        lines = [f"DeepSeek 对话记录 ({timestamp})\n", "=" * 50 + "\n"]
+        lines += [
+            f"[{idx//2+1}] {'用户' if msg['role'] == 'user' else '助手'}：{msg['content']}\n"
+            for idx, msg in enumerate(self.messages[1:])
+        ]
+        with open(txt_path, 'w', encoding='utf-8', buffering=1 << 16) as f:
+            f.write("".join(lines))
 
         return True
 
 
     def _generate_title(self):
         """使用对话内容生成标题"""
+        # 同一会话内只生成一次
+        if self._cached_title:
+            return self._cached_title
+
+        # 短且干净的首条用户输入本身就是合适的标题，省掉一次API调用
+        first_user = next((m for m in self._window if m['role'] == 'user'), None)
+        if (first_user and len(first_user['content']) <= 20
+                and _FILENAME_RE.search(first_user['content']) is None):
+            self._cached_title = self._sanitize_filename(first_user['content'])
+            return self._cached_title
+
         try:
             # 提取前两轮对话作为生成依据
             sample_msgs = self.messages[1:3]  # 跳过系统消息，取前两个用户/助手消息
@@ -214,7 +382,8 @@ class DeepSeekChat:
             
             # 清理生成的标题
             raw_title = response.choices[0].message.content.strip()
-            return self._sanitize_filename(raw_title)
+            self._cached_title = self._sanitize_filename(raw_title)
+            return self._cached_title
             
         except Exception as e:
             print(f"标题生成失败：{str(e)}")
@@ -223,22 +392,41 @@ class DeepSeekChat:
     @staticmethod
     def _sanitize_filename(title):
         """清理文件名中的非法字符"""
-        # 保留允许的字符：中文、字母、数字、下划线和空格
-        cleaned = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9_ ]', '', title)
+        # ASCII快速路径：一次translate删掉所有非法字符
+        if title.isascii():
+            cleaned = title.translate(_KEEP_TABLE)
+        else:
+            # 保留允许的字符：中文、字母、数字、下划线和空格
+            cleaned = ''.join(c for c in title if ord(c) in _ALLOW)
         # 去除首尾空格并截断到30字符
         return cleaned.strip()[:30]
 
 
 
 
+_HISTORY_FILE = os.path.expanduser('~/.deepseek_history')
+
+
+def _setup_readline():
+    """加载持久化的输入历史"""
+    if readline is None:
+        return
+    try:
+        readline.read_history_file(_HISTORY_FILE)
+    except FileNotFoundError:
+        pass
+    readline.set_history_length(1000)
+    atexit.register(readline.write_history_file, _HISTORY_FILE)
+
+
 def get_user_input(prompt):
-    readline.add_history(prompt)
-    user_input = input(prompt)
-    return user_input
+    # 导入readline后 input() 会自动把输入行加入历史
+    return input(prompt)
 
 
 def main():
     try:
+        _setup_readline()
         chat = DeepSeekChat()
         print("DeepSeek (V3)\n")
         